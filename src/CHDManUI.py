@@ -2,11 +2,13 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import subprocess
 import os
-import glob
 import sys
 import shutil
 import threading
-import re
+import contextlib
+import errno
+import selectors
+from concurrent.futures import ThreadPoolExecutor
 
 # Optional drag-and-drop support
 try:
@@ -28,6 +30,39 @@ def find_chdman():
     return None
 
 CHDMAN_PATH = find_chdman()
+# Checked once here; the convert buttons are disabled when chdman is missing
+_CHDMAN_OK = CHDMAN_PATH is not None
+# Cleared the first time the OS refuses to resize chdman's stdout pipe
+_pipesize_ok = sys.version_info >= (3, 10)
+
+_PCT_NUMBER = frozenset(b"0123456789.")
+_PCT_SPACE = frozenset(b" \t")
+
+# Find the newest percentage in buffer[start:], e.g. 2% or 2.1%, scanning back from
+# the last '%' with rfind. Returns (pct or None, position just past the last '%').
+def find_last_percent(buffer, start=0):
+    end = len(buffer)
+    scanned = buffer.rfind(b"%", start, end) + 1 or start
+    while True:
+        pct_end = buffer.rfind(b"%", start, end)
+        if pct_end < 0:
+            return None, scanned
+        i = pct_end
+        while i > start and buffer[i - 1] in _PCT_SPACE:
+            i -= 1
+        num_end = i
+        while i > start and buffer[i - 1] in _PCT_NUMBER:
+            i -= 1
+        # Skip compression figures like "(ratio=45.6%)" / "final ratio = 45.6%"
+        j = i
+        while j > 0 and buffer[j - 1] in _PCT_SPACE:
+            j -= 1
+        if num_end > i and not (j > 0 and buffer[j - 1] == ord("=")):
+            try:
+                return float(buffer[i:num_end]), scanned
+            except ValueError:
+                pass
+        end = pct_end
 
 SYSTEMS = [
     "Sony PlayStation (PS1)",
@@ -51,83 +86,152 @@ SYSTEM_FILETYPES = {
     "Sega Saturn": [".cue", ".iso"],
     "Sega Dreamcast": [".gdi", ".cue", ".cdi", ".iso"],
     "Sega / Mega CD": [".cue", ".iso"],
-    "Neo Geo CD": [".cue", ".iso"],
-    "TurboGrafx / PC Engine CD": [".cue", ".iso"],
+    "SNK Neo Geo CD": [".cue", ".iso"],
+    "NEC TurboGrafx CD / PC Engine CD": [".cue", ".iso"],
     "3DO": [".cue", ".iso"],
     "Commodore Amiga CD32": [".cue", ".iso"],
 }
+# Every dropdown entry needs its own extensions, or it silently falls back to the defaults
+assert set(SYSTEM_FILETYPES) >= set(SYSTEMS), set(SYSTEMS) - set(SYSTEM_FILETYPES)
 
-def build_filetypes(system: str):
-    exts = SYSTEM_FILETYPES.get(system, [".cue", ".gdi", ".iso"])
+def _make_filetypes(exts):
     patterns = " ".join(f"*{e}" for e in exts)
     return [("Disc files", patterns), ("All files", "*.*")], exts
 
+# Dialog filetypes are fixed per system, so build them once up front
+_FILETYPE_CACHE = {s: _make_filetypes(exts) for s, exts in SYSTEM_FILETYPES.items()}
+_DEFAULT_FILETYPES = _make_filetypes([".cue", ".gdi", ".iso"])
+
+def build_filetypes(system: str):
+    return _FILETYPE_CACHE.get(system, _DEFAULT_FILETYPES)
+
+def find_disc_files(folder, exts):
+    # One directory pass, matching extensions case-insensitively. Hidden files are
+    # skipped like glob did (e.g. macOS "._Game.cue" AppleDouble files).
+    # Unreadable or missing folders yield nothing, as glob did.
+    ext_set = {e.lower() for e in exts}
+    try:
+        with os.scandir(folder) as entries:
+            return [os.path.join(folder, d.name) for d in entries
+                    if not d.name.startswith(".") and d.is_file()
+                    and os.path.splitext(d.name)[1].lower() in ext_set]
+    except OSError:
+        return []
+
+# Systems whose .iso images are DVDs rather than CDs
+_DVD_ISO_SYSTEMS = frozenset({"Sony PlayStation 2 (PS2)"})
+
 def choose_subcommand(system: str, input_path: str) -> str:
     # PS2 DVD images should use createdvd, CDs use createcd
-    if "PlayStation 2" in system and input_path.lower().endswith(".iso"):
+    if system in _DVD_ISO_SYSTEMS and input_path.lower().endswith(".iso"):
         return "createdvd"
     return "createcd"
 
 # --- Conversion Functions ---
-def run_chdman(input_file, output_file, progress_cb=None, subcommand: str = "createcd"):
-    if not CHDMAN_PATH:
-        messagebox.showerror("Error", "Could not find chdman.exe!\nPut it in the same folder or PATH.")
-        return False
+def open_log():
+    # open a small log next to the script/exe to inspect later; shared by a whole run
+    # (each job writes its own output as one labelled block, see _write_log)
+    log_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chd_output.log")
+    try:
+        return open(log_path, "ab")
+    except Exception:
+        return contextlib.nullcontext()
+
+def _write_log(logf, input_file, chunks):
+    # One write per job so output from parallel conversions doesn't interleave,
+    # flushed right away so it survives quitting mid-batch
+    try:
+        logf.write(b"=== " + os.fsencode(input_file) + b" ===\n" + b"".join(chunks) + b"\n")
+        logf.flush()
+    except Exception:
+        pass
+
+def read_output(stream, size=65536):
+    # Yield chdman output as soon as it arrives, up to `size` bytes at a time.
+    # Windows pipes can't be polled, so there a blocking read1() does the same job.
+    if os.name == "nt":
+        while True:
+            chunk = stream.read1(size)
+            if not chunk:
+                return
+            yield chunk
+    fd = stream.fileno()
+    os.set_blocking(fd, False)
+    with selectors.DefaultSelector() as sel:
+        sel.register(fd, selectors.EVENT_READ)
+        while True:
+            sel.select()
+            try:
+                chunk = os.read(fd, size)
+            except BlockingIOError:
+                continue
+            if not chunk:
+                return
+            yield chunk
+
+def run_chdman(input_file, output_file, progress_cb=None, subcommand: str = "createcd", logf=None,
+               numprocessors=None, label=None):
+    global _pipesize_ok
+    # Let chdman compress hunks on several cores (defaults to all of them)
+    np = max(1, numprocessors or os.cpu_count() or 2)
+    # chdman output for the log, written in one go when this job ends
+    log_chunks = []
     try:
+        popen_kwargs = {}
+        if os.name == "nt":
+            # Don't attach (or flash) a console window for each chdman run
+            si = subprocess.STARTUPINFO()
+            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            si.wShowWindow = 0  # SW_HIDE
+            popen_kwargs["startupinfo"] = si
+            popen_kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW
+        if _pipesize_ok:
+            # Larger pipe so chdman doesn't stall on write() while we're busy
+            # (only honored on Linux, ignored elsewhere)
+            popen_kwargs["pipesize"] = 1 << 20
         # Stream output so we can parse percentages as they appear
-        proc = subprocess.Popen(
-            [CHDMAN_PATH, subcommand, "-i", input_file, "-o", output_file],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=0,  # unbuffered so we see CR updates
-            universal_newlines=True,
-        )
+        args = [CHDMAN_PATH, subcommand, "-np", str(np), "-i", input_file, "-o", output_file]
+        try:
+            proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **popen_kwargs)
+        except PermissionError as e:
+            # Resizing the pipe can fail with EPERM (above pipe-max-size or the user's
+            # pipe quota) before chdman is launched; it's only a hint, so retry with the
+            # default size and stop asking for it on later runs
+            if e.errno != errno.EPERM or "pipesize" not in popen_kwargs:
+                raise
+            _pipesize_ok = False
+            del popen_kwargs["pipesize"]
+            proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **popen_kwargs)
 
         # Some chdman builds update progress using carriage returns without newlines.
-        # Read small chunks and search for percentages incrementally.
+        # read_output() hands over whatever is already in the pipe instead of
+        # waiting for a full block, so CR updates still show up promptly.
         if proc.stdout is not None:
-            buffer = ""
-            # open a small log next to the script/exe to inspect later
-            log_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chd_output.log")
-            try:
-                logf = open(log_path, "a", encoding="utf-8", errors="ignore")
-            except Exception:
-                logf = None
-            while True:
-                chunk = proc.stdout.read(64)
-                if not chunk:
-                    break
-                buffer += chunk
+            # Work on raw bytes, trimmed in place; only the UI tail needs decoding
+            buffer = bytearray()
+            # Only scan text we haven't matched yet so percentages aren't reported twice
+            scan_pos = 0
+            # chdman repeats the same percentage many times; only forward increases
+            last_pct = -1.0
+            for chunk in read_output(proc.stdout):
+                buffer.extend(chunk)
                 # Mirror last snippet to the UI for debugging
-                tail = buffer[-80:].replace("\r", " ").replace("\n", " ")
-                try:
-                    root.after(0, lambda t=tail: output_tail_var.set(t))
-                except Exception:
-                    pass
+                tail = buffer[-80:].decode("ascii", "replace").replace("\r", " ").replace("\n", " ")
+                if label:
+                    # Several batch jobs share the label; say which file this text is from
+                    tail = f"{label}: {tail}"
+                _queue_ui(tail=tail)
                 if logf:
-                    try:
-                        logf.write(chunk)
-                        logf.flush()
-                    except Exception:
-                        pass
+                    log_chunks.append(chunk)
                 if progress_cb:
-                    # Match integers or decimals before '%', e.g., 2% or 2.1%
-                    for m in re.finditer(r"(\d{1,3}(?:\.\d+)?)\s*%", buffer):
-                        try:
-                            pct = float(m.group(1))
-                            if 0.0 <= pct <= 100.0:
-                                progress_cb(pct)
-                        except ValueError:
-                            pass
+                    pct, scan_pos = find_last_percent(buffer, scan_pos)
+                    if pct is not None and last_pct < pct <= 100.0:
+                        last_pct = pct
+                        progress_cb(pct)
                 # Keep a small tail to catch split tokens like '9' + '%'
                 if len(buffer) > 128:
-                    buffer = buffer[-16:]
-            if logf:
-                try:
-                    logf.close()
-                except Exception:
-                    pass
+                    scan_pos = max(0, scan_pos - (len(buffer) - 16))
+                    del buffer[:-16]
         proc.wait()
         # Ensure we end at 100% on success
         if proc.returncode == 0 and progress_cb:
@@ -135,6 +239,9 @@ def run_chdman(input_file, output_file, progress_cb=None, subcommand: str = "cre
         return proc.returncode == 0
     except Exception:
         return False
+    finally:
+        if logf:
+            _write_log(logf, input_file, log_chunks)
 
 def update_status(message):
     # Ensure UI updates happen on the main thread
@@ -143,36 +250,105 @@ def update_status(message):
     except Exception:
         pass
 
+# Latest output tail / percentage from the worker, applied by a single pending Tk tick
+_ui_lock = threading.Lock()
+_ui_latest = {}
+_ui_pending = False
+
+def _flush_ui():
+    global _ui_pending
+    with _ui_lock:
+        updates = dict(_ui_latest)
+        _ui_latest.clear()
+        _ui_pending = False
+    if "tail" in updates:
+        output_tail_var.set(updates["tail"])
+    if "pct" in updates:
+        clamped = updates["pct"]
+        # make sure we're in determinate mode and not animating
+        try:
+            progress_bar.stop()
+        except Exception:
+            pass
+        progress_bar.config(mode="determinate", value=int(round(clamped)), maximum=100)
+        percent_var.set(f"{clamped:.1f}%")
+    if "percent" in updates:
+        percent_var.set(updates["percent"])
+
+def _queue_ui(**updates):
+    # Coalesce bursts of updates so chdman output can't flood the Tk event queue
+    global _ui_pending
+    with _ui_lock:
+        _ui_latest.update(updates)
+        if _ui_pending:
+            return
+        _ui_pending = True
+    try:
+        root.after(30, _flush_ui)
+    except Exception:
+        with _ui_lock:
+            _ui_pending = False
+
 def set_progress(pct):
     try:
-        clamped = max(0.0, min(100.0, float(pct)))
-        def apply():
-            # make sure we're in determinate mode and not animating
-            try:
-                progress_bar.stop()
-            except Exception:
-                pass
-            progress_bar.config(mode="determinate", value=int(round(clamped)), maximum=100)
-            percent_var.set(f"{clamped:.1f}%")
-        root.after(0, apply)
+        _queue_ui(pct=max(0.0, min(100.0, float(pct))))
     except Exception:
         pass
 
 def convert_files(files, system):
-    total, success, fail = len(files), 0, 0
-    for idx, f in enumerate(files, 1):
-        output_file = os.path.splitext(f)[0] + ".chd"
-        update_status(f"[{idx}/{total}] Converting: {os.path.basename(f)}")
-        # Reset progress for each file
-        set_progress(0)
-        subcmd = choose_subcommand(system, f)
-        if run_chdman(f, output_file, progress_cb=set_progress, subcommand=subcmd):
-            success += 1
-        else:
-            fail += 1
+    total = len(files)
+    # Resolve each file's name, output path and subcommand once, up front
+    jobs = [(idx, f, os.path.basename(f), os.path.splitext(f)[0] + ".chd", choose_subcommand(system, f))
+            for idx, f in enumerate(files)]
+    # Files that map to the same .chd (e.g. Game.cue + Game.iso) must not race on it;
+    # keep them in one group that runs serially, as the old sequential loop did
+    groups = {}
+    for job in jobs:
+        groups.setdefault(os.path.normcase(os.path.abspath(job[3])), []).append(job)
+    # Run several chdman processes at once and split the cores between them
+    cores = os.cpu_count() or 2
+    workers = max(1, min(len(groups), cores // 2))
+    np_per_job = max(1, cores // workers)
+    # Per-file percentages, averaged into the single progress bar
+    progress = [0.0] * total
+    progress_sum = 0.0
+    done = 0
+    progress_lock = threading.Lock()
+
+    def report(idx, pct):
+        nonlocal progress_sum
+        with progress_lock:
+            progress_sum += pct - progress[idx]
+            progress[idx] = pct
+            overall = progress_sum / total
+        set_progress(overall)
+
+    def convert_one(job):
+        nonlocal done
+        idx, f, name, output_file, subcmd = job
+        ok = run_chdman(f, output_file, progress_cb=lambda pct: report(idx, pct),
+                        subcommand=subcmd, logf=logf, numprocessors=np_per_job, label=name)
+        # A failed job still counts as finished for the overall bar
+        report(idx, 100.0)
+        with progress_lock:
+            done += 1
+            finished = done
+        update_status(f"Converting: {finished}/{total} done ({name})")
+        return ok
+
+    def convert_group(group):
+        return [convert_one(job) for job in group]
+
+    set_progress(0)
+    update_status(f"Converting: 0/{total} done")
+    with open_log() as logf, ThreadPoolExecutor(max_workers=workers) as pool:
+        results = [ok for group_results in pool.map(convert_group, groups.values())
+                   for ok in group_results]
+    success = sum(1 for ok in results if ok)
+    fail = total - success
     update_status("Idle")
     set_progress(0)
-    percent_var.set("")
+    _queue_ui(percent="")
     messagebox.showinfo("Batch Complete", f"{system}\nConverted: {success}\nFailed: {fail}")
 
 # --- UI Functions ---
@@ -192,10 +368,11 @@ def select_single():
         update_status(f"[1/1] Converting: {os.path.basename(cue_file)}")
         set_progress(0)
         subcmd = choose_subcommand(system, cue_file)
-        ok = run_chdman(cue_file, save_file, progress_cb=set_progress, subcommand=subcmd)
+        with open_log() as logf:
+            ok = run_chdman(cue_file, save_file, progress_cb=set_progress, subcommand=subcmd, logf=logf)
         update_status("Idle")
         set_progress(0)
-        percent_var.set("")
+        _queue_ui(percent="")
         messagebox.showinfo("Conversion Complete", f"{system}\nConverted: {1 if ok else 0}\nFailed: {0 if ok else 1}")
     threading.Thread(target=single_convert, daemon=True).start()
 
@@ -204,29 +381,27 @@ def select_batch():
     folder = filedialog.askdirectory(title="Select Folder with Disc Images")
     if not folder: return
     _, exts = build_filetypes(system)
-    files = []
-    for e in exts:
-        files += glob.glob(os.path.join(folder, f"*{e}"))
+    files = find_disc_files(folder, exts)
     if not files:
         messagebox.showwarning("No files", "No .cue/.gdi/.iso files found.")
         return
     threading.Thread(target=convert_files, args=(files, system), daemon=True).start()
 
 def handle_drop(event):
+    if not _CHDMAN_OK:
+        return
     paths = root.tk.splitlist(event.data)
-    files, folders = [], []
+    # A set so a file dropped alongside its folder isn't converted twice
+    files, folders = set(), []
     for p in paths:
         if os.path.isfile(p) and p.lower().endswith(('.cue', '.gdi', '.iso', '.cdi')):
-            files.append(p)
+            files.add(os.path.normpath(p))
         elif os.path.isdir(p):
             folders.append(p)
     for folder in folders:
-        files += glob.glob(os.path.join(folder, "*.cue")) + \
-                 glob.glob(os.path.join(folder, "*.gdi")) + \
-                 glob.glob(os.path.join(folder, "*.iso")) + \
-                 glob.glob(os.path.join(folder, "*.cdi"))
+        files.update(os.path.normpath(f) for f in find_disc_files(folder, ('.cue', '.gdi', '.iso', '.cdi')))
     if files:
-        threading.Thread(target=convert_files, args=(files, system_var.get()), daemon=True).start()
+        threading.Thread(target=convert_files, args=(sorted(files), system_var.get()), daemon=True).start()
 
 # --- UI Setup ---
 # Create the root window; if DnD is available, use the specialized Tk class.
@@ -260,11 +435,15 @@ system_dropdown.pack(pady=5)
 
 button_width = 30  # uniform width for all buttons
 
-ttk.Button(frame, text="Convert Single File", command=select_single, width=button_width).pack(pady=10)
-ttk.Button(frame, text="Batch Convert Folder", command=select_batch, width=button_width).pack(pady=10)
+convert_state = "normal" if _CHDMAN_OK else "disabled"
+ttk.Button(frame, text="Convert Single File", command=select_single, width=button_width,
+           state=convert_state).pack(pady=10)
+ttk.Button(frame, text="Batch Convert Folder", command=select_batch, width=button_width,
+           state=convert_state).pack(pady=10)
 ttk.Button(frame, text="Quit", command=root.quit, width=button_width).pack(pady=10)
 
-status_var = tk.StringVar(value="Idle")
+status_var = tk.StringVar(value="Idle" if _CHDMAN_OK else
+                          "Could not find chdman.exe! Put it in the same folder or PATH.")
 status_label = ttk.Label(frame, textvariable=status_var)
 status_label.pack(pady=10)
 